@@ -0,0 +1,128 @@
+"""
+NAEYLA-XS Chat Micro-Batcher
+Coalesces concurrent /chat generations into one batched model call
+"""
+
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+# Max prompts per batched forward, and how long the first request waits for company
+MAX_BATCH = int(os.getenv("NAEYLA_MAX_BATCH", "8"))
+MAX_WAIT_MS = float(os.getenv("NAEYLA_MAX_WAIT_MS", "15"))
+
+# MLX runs one GPU stream, so all blocking model work shares this one worker thread.
+# Other blocking calls (prompt embeddings, KV flush) stay on the default pool and never
+# queue behind a generation
+MODEL_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mlx")
+
+
+async def run_model(fn: Callable[..., Any], *args: Any) -> Any:
+    """Run blocking model work on the MLX thread"""
+    return await asyncio.get_running_loop().run_in_executor(MODEL_EXECUTOR, fn, *args)
+
+
+# (message, mode, browser_enabled, conversation_id, future)
+_Item = Tuple[str, str, bool, Optional[str], asyncio.Future]
+
+
+class ChatBatcher:
+    """Queues chat requests and dispatches them to NaeylaBackbone.chat_batch"""
+
+    def __init__(
+        self,
+        get_model: Callable[[], Awaitable[Any]],
+        max_batch: int = MAX_BATCH,
+        max_wait_ms: float = MAX_WAIT_MS
+    ):
+        # get_model is awaited per batch so the backbone can stay lazy-loaded
+        self.get_model = get_model
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the background dispatch loop (call from the running event loop)"""
+        if self._task is not None:
+            return
+        self.queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the dispatch loop and fail anything still queued"""
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        while not self.queue.empty():
+            *_, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Chat batcher stopped"))
+
+    async def submit(
+        self,
+        message: str,
+        mode: str = "companion",
+        browser_enabled: bool = False,
+        conversation_id: Optional[str] = None
+    ) -> str:
+        """Queue one chat turn and wait for its response"""
+        if self._task is None:
+            self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((message, mode, browser_enabled, conversation_id, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch: List[_Item] = [await self.queue.get()]
+
+            # Collect whatever else arrives inside the batching window
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._dispatch(batch)
+
+    async def _dispatch(self, batch: List[_Item]):
+        # Skip requests whose client already went away
+        batch = [item for item in batch if not item[-1].done()]
+        if not batch:
+            return
+
+        messages = [item[0] for item in batch]
+        modes = [item[1] for item in batch]
+        browser_flags = [item[2] for item in batch]
+        conversation_ids = [item[3] for item in batch]
+
+        try:
+            naeyla = await self.get_model()
+            responses = await run_model(
+                naeyla.chat_batch, messages, modes, browser_flags, conversation_ids
+            )
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (*_, future), response in zip(batch, responses):
+            if not future.done():
+                future.set_result(response)
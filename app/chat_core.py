@@ -0,0 +1,283 @@
+"""
+NAEYLA-XS Chat Pipeline
+The one /chat code path: routing, perception, caching, generation, action execution
+Servers wrap it with their own auth and transport
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+from app.batcher import run_model
+from dsl.actions import ActionType
+from model.action_parser import (
+    TRIGGER_BROWSER, TRIGGER_PAGE, extract_actions_from_message, scan_message,
+    strip_and_extract_actions
+)
+
+# ==================== MODELS ====================
+
+_ALLOWED_MODES = frozenset({"companion", "advisor", "guardian"})
+
+class ChatRequest(BaseModel):
+    # Strict: no type coercion on the hot path (e.g. a numeric "message" is a 422, not "123")
+    model_config = ConfigDict(strict=True, extra="ignore")
+
+    message: str
+    mode: str = "companion"
+    conversation_id: Optional[str] = None
+
+    @field_validator("message")
+    @classmethod
+    def message_not_empty_or_too_long(cls, v: str) -> str:
+        if not v.strip():
+            raise ValueError("message must not be empty")
+        if len(v) > 8000:
+            raise ValueError("message exceeds maximum length of 8000 characters")
+        return v
+
+    @field_validator("mode")
+    @classmethod
+    def mode_must_be_valid(cls, v: str) -> str:
+        if v not in _ALLOWED_MODES:
+            raise ValueError(f"mode must be one of {sorted(_ALLOWED_MODES)}")
+        return v
+
+    @field_validator("conversation_id")
+    @classmethod
+    def conversation_id_not_too_long(cls, v: Optional[str]) -> Optional[str]:
+        if v is not None and len(v) > 128:
+            raise ValueError("conversation_id exceeds maximum length of 128 characters")
+        return v
+
+class ChatResponse(BaseModel):
+    response: str
+    mode: str
+    actions: list = Field(default_factory=list)
+
+# ==================== PIPELINE ====================
+
+# Actions the chat loop executes
+_EXECUTABLE_ACTIONS = frozenset({ActionType.NAVIGATE, ActionType.CLICK, ActionType.TYPE,
+                                 ActionType.SCREENSHOT, ActionType.SCROLL, ActionType.SEARCH})
+
+
+class ChatPipeline:
+    """
+    Runs chat turns end to end
+    validate_action (dict -> bool) and audit_log are supplied by secure servers;
+    leave them as None to execute every parsed action without auditing
+    """
+
+    def __init__(
+        self,
+        batcher,
+        get_model: Callable[[], Awaitable[Any]],
+        get_browser: Callable[[], Any],
+        *,
+        lm_cache=None,
+        embed: Optional[Callable[[str], Awaitable[Any]]] = None,
+        validate_action: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        audit_log: Optional[logging.Logger] = None
+    ):
+        self.batcher = batcher
+        self.get_model = get_model
+        self.get_browser = get_browser
+        self.lm_cache = lm_cache
+        self.embed = embed
+        self.validate_action = validate_action
+        self.audit_log = audit_log
+
+    async def run_chat(self, request: ChatRequest) -> ChatResponse:
+        """One complete chat turn (micro-batched with concurrent turns)"""
+        turn = await self._begin(request)
+        if turn.cached is not None:
+            return ChatResponse(response=turn.cached, mode=request.mode, actions=[])
+
+        _, message = await self._prepare(turn)
+        response = await self.batcher.submit(
+            message,
+            request.mode,
+            turn.browser_enabled,
+            request.conversation_id
+        )
+
+        response_clean, action_results = await self._finish(turn, response)
+        return ChatResponse(response=response_clean, mode=request.mode, actions=action_results)
+
+    async def stream_chat(self, request: ChatRequest) -> AsyncIterator[Dict[str, Any]]:
+        """
+        One chat turn as events: {"token": ...} while decoding, then one
+        {"done": True, ...} event carrying the same fields as run_chat
+        """
+        turn = await self._begin(request)
+        if turn.cached is not None:
+            yield {"token": turn.cached}
+            yield {"done": True, "response": turn.cached, "mode": request.mode, "actions": []}
+            return
+
+        naeyla, message = await self._prepare(turn)
+
+        chunks = []
+        async for text in iterate_in_thread(
+            naeyla.chat_stream,
+            message,
+            request.mode,
+            turn.browser_enabled,
+            request.conversation_id
+        ):
+            chunks.append(text)
+            yield {"token": text}
+
+        response_clean, action_results = await self._finish(turn, "".join(chunks))
+        yield {
+            "done": True,
+            "response": response_clean,
+            "mode": request.mode,
+            "actions": action_results
+        }
+
+    async def _begin(self, request: ChatRequest) -> "_Turn":
+        """Route the message and start anything that can overlap with generation"""
+        turn = _Turn(request, self.get_browser(), scan_message(request.message))
+
+        # Perception runs in the background until the message is actually built
+        if turn.browser.is_running and TRIGGER_PAGE in turn.triggers:
+            turn.perception_task = asyncio.create_task(turn.browser.get_page_perception())
+
+        # Only self-contained turns that never touch the browser can be served from cache
+        turn.cacheable = (
+            self.lm_cache is not None and not turn.triggers and not request.conversation_id
+        )
+        if turn.cacheable:
+            # Exact level first; the prompt is only embedded (for the semantic level, and for
+            # put() after generation) when that misses
+            turn.cached = self.lm_cache.get(request.mode, request.message)
+            if turn.cached is None and self.embed is not None:
+                turn.embedding = await self.embed(request.message)
+                if turn.embedding is not None:
+                    turn.cached = self.lm_cache.get(request.mode, request.message, turn.embedding)
+
+        return turn
+
+    async def _prepare(self, turn: "_Turn") -> Tuple[Any, str]:
+        """
+        Get the model ready and build the message; while page perception runs, the MLX
+        thread loads a cold model and readies the turn's KV state (conversation cache
+        from SSD, or the system prompt prefill), and the context is awaited last
+        """
+        naeyla = await self.get_model()
+        request = turn.request
+        if turn.perception_task is not None:
+            await run_model(
+                naeyla.prefetch_turn, request.mode, turn.browser_enabled, request.conversation_id
+            )
+        return naeyla, await turn.message_with_context()
+
+    async def _finish(self, turn: "_Turn", response: str) -> Tuple[str, List[Dict[str, Any]]]:
+        """Run actions and fill the cache after generation"""
+        request = turn.request
+        response_clean, action_results = await self.run_actions(request.message, response, turn.browser)
+
+        if turn.cacheable and not action_results and "<|action|>" not in response:
+            self.lm_cache.put(request.mode, request.message, response_clean, turn.embedding)
+
+        return response_clean, action_results
+
+    async def run_actions(self, message: str, response: str, browser) -> Tuple[str, List[Dict[str, Any]]]:
+        """Strip action tags from the reply and execute validated actions; returns (clean, results)"""
+        response_clean, model_actions = strip_and_extract_actions(response)
+        user_actions = extract_actions_from_message(message, response)
+        all_actions = user_actions if user_actions else model_actions
+
+        runnable = []
+        for action in all_actions:
+            action_dict = {"action": action.action_type.value, "params": action.params}
+
+            if self.validate_action is not None and not self.validate_action(action_dict):
+                if self.audit_log is not None:
+                    self.audit_log.warning("🚨 [SECURITY] Blocked action: %s", action.action_type.value)
+                continue
+
+            if action.action_type in _EXECUTABLE_ACTIONS:
+                runnable.append(action)
+
+        action_results = []
+        if not runnable:
+            return response_clean, action_results
+
+        # The browser batches the plan (concurrent reads, coalesced scrolls, settled steps)
+        results = await browser.execute_actions(runnable)
+
+        for action, result in zip(runnable, results):
+            action_results.append({
+                "action": action.action_type.value,
+                "params": action.params,
+                "result": result
+            })
+            if self.audit_log is not None:
+                self.audit_log.info("✅ [AUDIT] Action: %s", action.action_type.value)
+
+        return response_clean, action_results
+
+
+class _Turn:
+    """Per-request state shared between the start and end of a chat turn"""
+
+    def __init__(self, request: ChatRequest, browser, triggers: frozenset):
+        self.request = request
+        self.browser = browser
+        self.triggers = triggers
+        self.browser_enabled = TRIGGER_BROWSER in triggers
+        self.perception_task: Optional[asyncio.Task] = None
+        self.cacheable = False
+        self.embedding = None
+        self.cached: Optional[str] = None
+
+    async def message_with_context(self) -> str:
+        """Attach the current page perception (if one was started) to the message"""
+        message = self.request.message
+        if self.perception_task is None:
+            return message
+
+        perception = await self.perception_task
+        if perception.get("success"):
+            page_context = f"\n\nCURRENT PAGE:\n{perception['text']}"
+            return f"{message}\n\n{page_context}"
+        return message
+
+
+async def iterate_in_thread(gen_fn, *args):
+    """Drive a blocking generator on the MLX thread and yield its items on the event loop"""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for item in gen_fn(*args):
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+                if stop.is_set():
+                    break
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    producer = asyncio.ensure_future(run_model(produce))
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Client went away or we finished: let the generator wind down and release its cache
+        stop.set()
+        await producer
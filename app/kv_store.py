@@ -0,0 +1,206 @@
+"""
+NAEYLA-XS Conversation KV Store
+Two-tier (RAM LRU + SSD safetensors) storage for per-conversation prompt caches
+Caches reach SSD only when evicted from RAM (written by a background thread) or on
+shutdown; the SSD tier is capped too
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+KV_DIR = os.getenv("NAEYLA_KV_DIR", str(Path.home() / ".naeyla" / "kv"))
+KV_RAM_MB = int(os.getenv("NAEYLA_KV_RAM_MB", "512"))
+KV_DISK_MB = int(os.getenv("NAEYLA_KV_DISK_MB", "4096"))
+
+
+def _cache_nbytes(cache: List[Any]) -> int:
+    """Bytes held by a prompt cache (one entry per transformer layer)"""
+    return sum(layer.nbytes for layer in cache)
+
+
+class KVStore:
+    """
+    Holds prompt caches keyed by an opaque string (conversation + system prompt)
+    Hot entries live in RAM; they are written to SSD when evicted and on flush(),
+    and the least recently used files are deleted once the SSD tier passes max_disk_bytes
+    Eviction writes run on a writer thread, so put() never waits on the disk
+    """
+
+    def __init__(
+        self,
+        root: str = KV_DIR,
+        max_ram_bytes: int = KV_RAM_MB * 1024 * 1024,
+        max_disk_bytes: int = KV_DISK_MB * 1024 * 1024
+    ):
+        self.root = Path(root)
+        self.max_ram_bytes = max_ram_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._hot: "OrderedDict[str, List[Any]]" = OrderedDict()
+        self._hot_bytes = 0
+        self._dirty: set = set()
+        # Evicted caches whose SSD write is still queued or running
+        self._writing: Dict[str, Tuple[List[Any], Future]] = {}
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kv-writer")
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        # Hash the key so arbitrary conversation ids are safe as file names
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.root / f"{digest}.safetensors"
+
+    def get(self, key: str) -> Optional[List[Any]]:
+        """
+        Check out the cache for key (RAM first, then SSD)
+        The caller owns the returned cache and should put() it back after use
+        """
+        with self._lock:
+            cache = self._hot.pop(key, None)
+            if cache is not None:
+                self._hot_bytes -= _cache_nbytes(cache)
+                self._dirty.discard(key)
+                return cache
+            writing = self._writing.get(key)
+
+        if writing is not None:
+            # Evicted moments ago: hand the object back once the writer is done reading it
+            cache, future = writing
+            wait((future,))
+            return cache
+
+        return self._load(key)
+
+    def prefetch(self, key: str) -> bool:
+        """
+        Pull the cache for key from SSD into RAM ahead of get(); True if it is now in RAM
+        The file stays current, so the entry comes in clean (no rewrite on eviction)
+        """
+        with self._lock:
+            if key in self._hot or key in self._writing:
+                return True
+
+        cache = self._load(key)
+        if cache is None:
+            return False
+        # A put() by a turn that finished meanwhile is newer than the file, so it wins
+        self._insert(key, cache, dirty=False, replace=False)
+        return True
+
+    def _load(self, key: str) -> Optional[List[Any]]:
+        path = self._path(key)
+        if not path.exists():
+            return None
+        # mlx-lm is imported on first use so the server starts without it (the model is lazy too)
+        from mlx_lm.models.cache import load_prompt_cache
+
+        try:
+            cache = load_prompt_cache(str(path))
+            # mtime is the SSD tier's LRU clock
+            os.utime(path)
+            return cache
+        except Exception:
+            # Corrupt or incompatible file — drop it and start the conversation fresh
+            path.unlink(missing_ok=True)
+            return None
+
+    def put(self, key: str, cache: List[Any]):
+        """Store a cache in RAM; it reaches SSD on LRU eviction or flush()"""
+        self._insert(key, cache, dirty=True)
+
+    def _insert(self, key: str, cache: List[Any], dirty: bool, replace: bool = True):
+        evicted = []
+        with self._lock:
+            if not replace and key in self._hot:
+                return
+            old = self._hot.pop(key, None)
+            if old is not None:
+                self._hot_bytes -= _cache_nbytes(old)
+            self._hot[key] = cache
+            self._hot_bytes += _cache_nbytes(cache)
+            if dirty:
+                self._dirty.add(key)
+
+            while self._hot_bytes > self.max_ram_bytes and len(self._hot) > 1:
+                old_key, old_cache = self._hot.popitem(last=False)
+                self._hot_bytes -= _cache_nbytes(old_cache)
+                if old_key in self._dirty:
+                    self._dirty.discard(old_key)
+                    evicted.append(old_key)
+                    future = self._writer.submit(self._write_evicted, old_key, old_cache)
+                    self._writing[old_key] = (old_cache, future)
+
+            if evicted:
+                self._writer.submit(self._trim_disk)
+
+    def _write_evicted(self, key: str, cache: List[Any]):
+        """Writer thread: persist one evicted cache, then stop tracking it"""
+        try:
+            self._write(key, cache)
+        except Exception as e:
+            print(f"⚠️  Could not write KV cache to {self.root} ({e})")
+        finally:
+            with self._lock:
+                # A newer eviction of the same key may have queued its own write meanwhile
+                if self._writing.get(key, (None,))[0] is cache:
+                    del self._writing[key]
+
+    def discard(self, key: str):
+        """Forget a cache in both tiers"""
+        with self._lock:
+            cache = self._hot.pop(key, None)
+            if cache is not None:
+                self._hot_bytes -= _cache_nbytes(cache)
+            self._dirty.discard(key)
+            writing = self._writing.get(key)
+        if writing is not None:
+            # Let a queued write land first so it can't bring the file back
+            wait((writing[1],))
+        self._path(key).unlink(missing_ok=True)
+
+    def flush(self):
+        """
+        Write every dirty RAM entry to SSD (on shutdown, off the event loop)
+        Eviction writes still queued on the writer thread are waited for first
+        """
+        with self._lock:
+            pending = [(key, self._hot[key]) for key in self._dirty if key in self._hot]
+            self._dirty.clear()
+            writing = [future for _, future in self._writing.values()]
+
+        wait(writing)
+        for key, cache in pending:
+            self._write(key, cache)
+        if pending:
+            self._trim_disk()
+
+    def _write(self, key: str, cache: List[Any]):
+        from mlx_lm.models.cache import save_prompt_cache
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        # Write to a temp name first so a crash never leaves a half-written cache
+        tmp_path = path.with_name(f"{path.stem}.tmp.safetensors")
+        save_prompt_cache(str(tmp_path), cache)
+        os.replace(tmp_path, path)
+
+    def _trim_disk(self):
+        """Delete the least recently used cache files until the SSD tier fits max_disk_bytes"""
+        files = []
+        for path in self.root.glob("*.safetensors"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # removed concurrently
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
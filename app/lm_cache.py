@@ -0,0 +1,93 @@
+"""
+NAEYLA-XS Response Cache
+Exact-match and semantic-match caching of chat responses in front of the model
+"""
+
+import os
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+LM_CACHE_SIZE = int(os.getenv("NAEYLA_LM_CACHE_SIZE", "1024"))
+SEMANTIC_CACHE_SIZE = 256
+SEMANTIC_THRESHOLD = 0.95
+
+
+class LMCache:
+    """
+    Two-level response cache keyed by (mode, message)
+    - exact: LRU dict, checked first
+    - semantic: ring buffer of prompt embeddings, one matmul gives cosine scores
+    The semantic level is only used when the caller supplies an embedding
+    """
+
+    def __init__(
+        self,
+        max_entries: int = LM_CACHE_SIZE,
+        semantic_entries: int = SEMANTIC_CACHE_SIZE,
+        threshold: float = SEMANTIC_THRESHOLD
+    ):
+        self.max_entries = max_entries
+        self.semantic_entries = semantic_entries
+        self.threshold = threshold
+
+        self._exact: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+
+        # Allocated on first put, once the embedding width is known
+        self._vectors: Optional[np.ndarray] = None
+        self._entries: list = [None] * semantic_entries  # (mode, response) per slot
+        self._next = 0
+
+    def get(self, mode: str, message: str, embedding: Optional[np.ndarray] = None) -> Optional[str]:
+        """Return a cached response for this prompt, or None"""
+        key = (mode, message)
+        response = self._exact.get(key)
+        if response is not None:
+            self._exact.move_to_end(key)
+            return response
+
+        if embedding is None or self._vectors is None:
+            return None
+
+        scores = self._vectors @ _normalize(embedding)
+        for slot in np.argsort(scores)[::-1]:
+            if scores[slot] < self.threshold:
+                break
+            entry = self._entries[slot]
+            if entry is not None and entry[0] == mode:
+                return entry[1]
+        return None
+
+    def put(self, mode: str, message: str, response: str, embedding: Optional[np.ndarray] = None):
+        """Cache a response for this prompt"""
+        key = (mode, message)
+        self._exact[key] = response
+        self._exact.move_to_end(key)
+        if len(self._exact) > self.max_entries:
+            self._exact.popitem(last=False)
+
+        if embedding is None:
+            return
+
+        vector = _normalize(embedding)
+        if self._vectors is None:
+            self._vectors = np.zeros((self.semantic_entries, vector.shape[0]), dtype=np.float32)
+
+        # Oldest slot is overwritten first
+        self._vectors[self._next] = vector
+        self._entries[self._next] = (mode, response)
+        self._next = (self._next + 1) % self.semantic_entries
+
+    def clear(self):
+        """Drop every cached response"""
+        self._exact.clear()
+        self._vectors = None
+        self._entries = [None] * self.semantic_entries
+        self._next = 0
+
+
+def _normalize(embedding: np.ndarray) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
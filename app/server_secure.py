@@ -11,16 +11,25 @@ os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 from fastapi import FastAPI, HTTPException, Header, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, field_validator
-import re
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from pydantic import BaseModel, ConfigDict, Field
+import orjson
+import queue
 import logging
+import logging.handlers
 import asyncio
 import ipaddress
+from functools import lru_cache, partial
 from typing import Optional
 from urllib.parse import urlparse
 
 from env.browser import BrowserController
-from dsl.actions import Action, ActionType, parse_action_from_text
+from dsl.actions import Action, lookup_action_type
+from app.batcher import ChatBatcher, run_model
+from app.chat_core import ChatPipeline, ChatRequest, ChatResponse
+from app.kv_store import KVStore
+from app.lm_cache import LMCache
 
 # ==================== SECURITY CONFIG ====================
 
@@ -34,24 +43,34 @@ if not NAEYLA_TOKEN:
     exit(1)
 
 
-ALLOWED_ACTIONS = {
+ALLOWED_ACTIONS = frozenset({
     "navigate", "click", "type", "scroll", "screenshot", 
     "get_text", "search", "get_links"
-}
+})
 
 # Audit logging — use an absolute path so the log lands next to this file
 # regardless of the working directory the server is started from.
 _LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "naeyla_audit.log")
-logging.basicConfig(
-    filename=os.path.normpath(_LOG_PATH),
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Handlers only enqueue records; a listener thread owns the file so disk writes
+# never block the event loop
+_log_queue = queue.Queue(-1)
+_log_file_handler = logging.FileHandler(os.path.normpath(_LOG_PATH))
+_log_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_file_handler)
+_log_listener.start()
+logging.getLogger().addHandler(logging.handlers.QueueHandler(_log_queue))
+logging.getLogger().setLevel(logging.INFO)
 logger = logging.getLogger(__name__)
 
 # ==================== FASTAPI SETUP ====================
 
-app = FastAPI(title="NAEYLA-XS Secure", version="1.0.0")
+class OrjsonResponse(JSONResponse):
+    """JSONResponse rendered with orjson (faster encoding of the chat/browser payloads)"""
+    
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+app = FastAPI(title="NAEYLA-XS Secure", version="1.0.0", default_response_class=OrjsonResponse)
 
 # CORS — restrict to the Tauri/Vite dev origin and packaged app origin.
 # allow_credentials is False because auth uses Authorization headers, not cookies.
@@ -74,14 +93,16 @@ def get_token(authorization: Optional[str] = Header(None)) -> str:
     raise HTTPException(status_code=401, detail="Invalid token")
 
 
-_BLOCKED_HOSTS = {
+_BLOCKED_HOSTS = frozenset({
     "localhost", "localhost.",
     "127.0.0.1", "0.0.0.0",
     "::1", "[::1]",
     # Cloud metadata services
     "169.254.169.254", "metadata.google.internal",
-}
+})
 
+# Pure function of the URL string, so repeat navigations skip urlparse entirely
+@lru_cache(maxsize=2048)
 def validate_url(url: str) -> bool:
     """Block localhost, private networks, and cloud metadata endpoints."""
     try:
@@ -104,19 +125,32 @@ def validate_url(url: str) -> bool:
     except Exception:
         return False
 
+@lru_cache(maxsize=2048)
+def _blocked_reason(action_type: Optional[str], url: str) -> Optional[str]:
+    """Why an action would be blocked ("action" or "url"), or None if it is allowed"""
+    if action_type not in ALLOWED_ACTIONS:
+        return "action"
+    if action_type == "navigate" and not validate_url(url):
+        return "url"
+    return None
+
 def validate_action(action_dict: dict) -> bool:
     """Validate action before execution"""
     action_type = action_dict.get("action")
-    
-    if action_type not in ALLOWED_ACTIONS:
-        logger.warning(f"🚨 [SECURITY] Blocked action: {action_type}")
+    # Only the URL of a navigate affects the decision, so that is all the cache keys on
+    url = action_dict.get("params", {}).get("url", "") if action_type == "navigate" else ""
+    if not isinstance(action_type, (str, type(None))) or not isinstance(url, str):
+        logger.warning("🚨 [SECURITY] Blocked malformed action: %s", action_type)
         return False
     
-    if action_type == "navigate":
-        url = action_dict.get("params", {}).get("url", "")
-        if not validate_url(url):
-            logger.warning(f"🚨 [SECURITY] Blocked URL: {url}")
-            return False
+    # The decision is cached; the audit log still records every blocked attempt
+    reason = _blocked_reason(action_type, url)
+    if reason == "action":
+        logger.warning("🚨 [SECURITY] Blocked action: %s", action_type)
+        return False
+    if reason == "url":
+        logger.warning("🚨 [SECURITY] Blocked URL: %s", url)
+        return False
     
     return True
 
@@ -135,6 +169,9 @@ memory = None
 naeyla_lock = asyncio.Lock()
 memory_lock = asyncio.Lock()
 
+# Per-conversation KV caches (RAM + ~/.naeyla/kv); written to disk on RAM eviction and shutdown
+kv_store = KVStore()
+
 def get_browser() -> BrowserController:
     global browser
     if browser is None:
@@ -147,7 +184,7 @@ async def get_naeyla():
         async with naeyla_lock:
             if naeyla is None:
                 from model.backbone_mlx import NaeylaBackbone
-                naeyla = await asyncio.to_thread(NaeylaBackbone)
+                naeyla = await run_model(partial(NaeylaBackbone, kv_store=kv_store))
     return naeyla
 
 async def get_memory():
@@ -161,10 +198,16 @@ async def get_memory():
                 memory = await asyncio.to_thread(MemoryRetriever)
     return memory
 
+# Concurrent /chat turns are coalesced into batched generations
+batcher = ChatBatcher(get_naeyla)
+
+# Repeated plain-chat turns (no browser, no conversation) are answered without the model
+lm_cache = LMCache()
+
 if NAEYLA_EAGER_LOAD:
     # Optional eager load for warm starts (use with caution on low-memory systems).
     from model.backbone_mlx import NaeylaBackbone
-    naeyla = NaeylaBackbone()
+    naeyla = NaeylaBackbone(kv_store=kv_store)
     browser = BrowserController()
     if NAEYLA_ENABLE_MEMORY:
         from app.memory.embeddings import MemoryRetriever
@@ -174,115 +217,103 @@ print("✅ Ready!")
 
 # ==================== MODELS ====================
 
-_ALLOWED_MODES = {"companion", "advisor", "guardian"}
-
-class ChatRequest(BaseModel):
-    message: str
-    mode: str = "companion"
-
-    @field_validator("message")
-    @classmethod
-    def message_not_empty_or_too_long(cls, v: str) -> str:
-        if not v.strip():
-            raise ValueError("message must not be empty")
-        if len(v) > 8000:
-            raise ValueError("message exceeds maximum length of 8000 characters")
-        return v
-
-    @field_validator("mode")
-    @classmethod
-    def mode_must_be_valid(cls, v: str) -> str:
-        if v not in _ALLOWED_MODES:
-            raise ValueError(f"mode must be one of {sorted(_ALLOWED_MODES)}")
-        return v
-
 class BrowserActionRequest(BaseModel):
-    action: str
-    params: dict = {}
+    model_config = ConfigDict(strict=True, extra="ignore")
 
-class ChatResponse(BaseModel):
-    response: str
-    mode: str
-    actions: list = []
+    action: str
+    params: dict = Field(default_factory=dict)
 
 # ==================== ENDPOINTS ====================
 
+async def _prompt_embedding(message: str):
+    """
+    Embedding for the semantic cache level; None (exact level only) unless
+    NAEYLA_ENABLE_MEMORY=1, in which case the first call loads the embedding model
+    """
+    retriever = await get_memory()
+    if retriever is None:
+        return None
+    return await asyncio.to_thread(retriever.embed_text, message)
+
+# Shared /chat pipeline; this server adds action validation and audit logging
+pipeline = ChatPipeline(
+    batcher,
+    get_naeyla,
+    get_browser,
+    lm_cache=lm_cache,
+    embed=_prompt_embedding,
+    validate_action=validate_action,
+    audit_log=logger
+)
+
+def _sse(payload: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"data: {orjson.dumps(payload).decode()}\n\n"
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest, token: str = Depends(get_token)):
     """Authenticated chat endpoint"""
-    
     try:
-        from model.action_parser import extract_actions_from_message, should_trigger_browser
-        
-        page_context = ""
-        browser = get_browser()
-        if browser.is_running:
-            perception = await browser.get_page_perception()
-            if perception.get("success"):
-                page_context = f"\n\nCURRENT PAGE:\n{perception['text']}"
-        
-        message_with_context = request.message
-        if page_context and ("see" in request.message.lower() or "page" in request.message.lower()):
-            message_with_context = f"{request.message}\n\n{page_context}"
-        
-        naeyla = await get_naeyla()
-        response = await asyncio.to_thread(
-            naeyla.chat,
-            message_with_context,
-            request.mode,
-            should_trigger_browser(request.message)
-        )
-        
-        response_clean = re.sub(r'<\|action\|>.*?(?=<\||$)', '', response, flags=re.DOTALL).strip()
-        
-        model_actions = parse_action_from_text(response)
-        user_actions = extract_actions_from_message(request.message, response)
-        all_actions = user_actions if user_actions else model_actions
-        
-        action_results = []
-        
-        for i, action in enumerate(all_actions):
-            action_dict = {"action": action.action_type.value, "params": action.params}
-            
-            if not validate_action(action_dict):
-                logger.warning(f"🚨 [SECURITY] Blocked action: {action.action_type.value}")
-                continue
-            
-            if action.action_type in [ActionType.NAVIGATE, ActionType.CLICK, ActionType.TYPE, 
-                                      ActionType.SCREENSHOT, ActionType.SCROLL, ActionType.SEARCH]:
-                result = await browser.execute_action(action)
-                action_results.append({
-                    "action": action.action_type.value,
-                    "params": action.params,
-                    "result": result
-                })
-                logger.info(f"✅ [AUDIT] Action: {action.action_type.value}")
-                
-                if i < len(all_actions) - 1:
-                    await asyncio.sleep(2)
-        
-        return ChatResponse(response=response_clean, mode=request.mode, actions=action_results)
-        
+        return await pipeline.run_chat(request)
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"❌ Error: {str(e)}")
+        logger.error("❌ Error: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, token: str = Depends(get_token)):
+    """
+    Authenticated streaming chat endpoint (Server-Sent Events)
+    Emits {"token": ...} events while decoding, then one {"done": true, ...} event
+    carrying the same fields as /chat
+    """
+    async def event_generator():
+        try:
+            async for event in pipeline.stream_chat(request):
+                yield _sse(event)
+        except Exception as e:
+            logger.error("❌ Error: %s", e)
+            yield _sse({"error": "Internal server error"})
+    
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
 @app.post("/browser/action")
 async def execute_browser_action(request: BrowserActionRequest, token: str = Depends(get_token)):
     """Authenticated browser action"""
     action_dict = {"action": request.action, "params": request.params}
     if not validate_action(action_dict):
-        logger.warning(f"🚨 [SECURITY] Blocked: {request.action}")
+        logger.warning("🚨 [SECURITY] Blocked: %s", request.action)
         raise HTTPException(status_code=400, detail="Action not allowed")
     
+    # Same name -> ActionType table (and error) as the DSL parser
+    try:
+        action_type = lookup_action_type(request.action)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Unknown action")
+    
     browser = get_browser()
-    action = Action(action_type=ActionType(request.action), params=request.params)
+    action = Action(action_type=action_type, params=request.params)
     result = await browser.execute_action(action)
-    logger.info(f"✅ [AUDIT] Direct action: {request.action}")
+    logger.info("✅ [AUDIT] Direct action: %s", request.action)
     return result
 
+# Unauthenticated liveness probe: raw ASGI, no routing/DI/auth, body is fixed at import
+_HEALTHZ_BODY = orjson.dumps({"status": "ok"})
+_HEALTHZ_HEADERS = [
+    (b"content-type", b"application/json"),
+    (b"content-length", str(len(_HEALTHZ_BODY)).encode()),
+]
+
+class _Healthz:
+    # A callable instance (not a function) so Starlette routes to it as a bare ASGI app
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": _HEALTHZ_HEADERS})
+        await send({"type": "http.response.body", "body": _HEALTHZ_BODY})
+
+# First in the route table so it matches before any FastAPI route is tried
+app.router.routes.insert(0, Route("/healthz", _Healthz(), methods=["GET", "HEAD"]))
+
 @app.get("/health")
 async def health(token: str = Depends(get_token)):
     """Health check"""
@@ -310,14 +341,40 @@ async def get_browser_perception(token: str = Depends(get_token)):
     browser = get_browser()
     if not browser.is_running:
         return {"running": False}
-    return await browser.get_page_perception()
+    return await browser.get_page_perception(include_tree=True)
+
+@app.on_event("startup")
+async def startup():
+    batcher.start()
+    
+    if naeyla is not None:
+        # Eagerly loaded: pay graph build and kernel compile now instead of on the first /chat
+        print("🔥 Warming up model...")
+        await run_model(naeyla.warmup, batcher.max_batch)
+        print("✅ Warmup complete")
 
 @app.on_event("shutdown")
 async def shutdown():
     logger.info("🛑 Server shutdown")
+    await batcher.stop()
+    await asyncio.to_thread(kv_store.flush)
     if browser is not None:
         await browser.stop()
+    _log_listener.stop()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=7861)
+    # Each worker is a separate process with its own model copy and batcher, so keep
+    # NAEYLA_WORKERS at 1 unless there is unified memory to spare
+    workers = int(os.getenv("NAEYLA_WORKERS", "1"))
+    uvicorn.run(
+        # Worker processes need an import string; a single worker serves this module's
+        # app directly, since importing "app.server_secure" again would rerun the setup
+        # above (banner, audit log listener, eager model load) a second time
+        "app.server_secure:app" if workers > 1 else app,
+        host="127.0.0.1",
+        port=7861,
+        workers=workers,
+        loop="uvloop",
+        http="httptools"
+    )
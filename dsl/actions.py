@@ -3,7 +3,8 @@ NAEYLA-XS Action Grammar (DSL)
 A simple language for expressing browser and system actions
 """
 
-from typing import Dict, Any, List
+import re
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from enum import Enum
 
 class ActionType(Enum):
@@ -28,9 +29,31 @@ class ActionType(Enum):
     REFLECT = "reflect"
     DENY = "deny"
 
+# Plain dict lookup; ActionType(value) goes through the Enum call machinery every time
+_ACTION_TYPE_BY_VALUE = {member.value: member for member in ActionType}
+
+def lookup_action_type(name: str) -> ActionType:
+    """ActionType for an action name; raises ValueError for unknown names"""
+    action_type = _ACTION_TYPE_BY_VALUE.get(name)
+    if action_type is None:
+        raise ValueError(f"Unknown action: {name!r}")
+    return action_type
+
+# <|action|>name(params) — no parentheses means no params, and the closing paren is optional
+_DSL_RE = re.compile(r'<\|action\|>([^(]*)(?:\(([^()]*))?', re.DOTALL)
+
+# key=value pairs inside the parentheses, comma separated
+_PARAM_RE = re.compile(r'([^,=]*)=([^,]*)')
+
+# Action tag in model output; the payload runs up to the next special token or end of text
+ACTION_TAG_RE = re.compile(r'<\|action\|>(.*?)(?=<\||$)', re.DOTALL)
+
 class Action:
     """Represents a single action"""
     
+    # One instance per parsed tag; slots skip the per-instance __dict__
+    __slots__ = ("action_type", "params", "reasoning")
+    
     def __init__(
         self,
         action_type: ActionType,
@@ -58,23 +81,20 @@ class Action:
     def from_dsl(cls, dsl_string: str) -> 'Action':
         """Parse DSL string to Action"""
         # Simple parser for: <|action|>navigate(url=example.com)
-        if not dsl_string.startswith("<|action|>"):
+        match = _DSL_RE.match(dsl_string)
+        if match is None:
             raise ValueError("Invalid DSL format")
         
-        dsl_string = dsl_string.replace("<|action|>", "")
-        action_name = dsl_string.split("(")[0]
+        action_name, params_str = match.groups()
         
-        # Extract params
+        # Extract params; surrounding whitespace is trimmed off each key=value pair as a whole
         params = {}
-        if "(" in dsl_string:
-            params_str = dsl_string.split("(")[1].split(")")[0]
-            for param in params_str.split(","):
-                if "=" in param:
-                    key, value = param.strip().split("=", 1)
-                    params[key] = value
+        if params_str:
+            for key, value in _PARAM_RE.findall(params_str):
+                params[key.lstrip()] = value.rstrip()
         
         return cls(
-            action_type=ActionType(action_name),
+            action_type=lookup_action_type(action_name),
             params=params
         )
 
@@ -90,25 +110,33 @@ ACTION_TEMPLATES = {
     "screenshot": Action(ActionType.SCREENSHOT, {}),
 }
 
-def parse_action_from_text(text: str) -> List[Action]:
+def iter_action_tags(text: str) -> Iterator[Tuple[int, int, Optional[Action]]]:
     """
-    Parse actions from Naeyla's text response
-    Looks for <|action|> tokens
+    Yield (start, end, action) for every action tag in Naeyla's text response
+    action is None for a malformed or unknown tag; its span is still reported
     """
-    actions = []
-    
-    # Split by action markers
-    parts = text.split("<|action|>")
-    
-    for part in parts[1:]:  # Skip first part (before any actions)
-        # Extract action string
-        action_end = part.find("<|") if "<|" in part else len(part)
-        action_str = part[:action_end].strip()
+    # One lazy scan over the text; no list of split-off parts
+    for match in ACTION_TAG_RE.finditer(text):
+        action_str = match.group(1).strip()
         
         try:
             action = Action.from_dsl(f"<|action|>{action_str}")
-            actions.append(action)
         except Exception:
-            continue
-    
-    return actions
+            action = None
+        yield match.start(), match.end(), action
+
+def iter_actions_from_text(text: str) -> Iterator[Action]:
+    """
+    Yield actions from Naeyla's text response as the scan reaches them
+    Malformed or unknown action tags are skipped
+    """
+    for _, _, action in iter_action_tags(text):
+        if action is not None:
+            yield action
+
+def parse_action_from_text(text: str) -> List[Action]:
+    """
+    Parse actions from Naeyla's text response
+    Looks for <|action|> tokens
+    """
+    return list(iter_actions_from_text(text))
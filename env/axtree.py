@@ -3,9 +3,27 @@ NAEYLA-XS AXTree Extractor
 Extracts accessibility tree from web pages for AI perception
 """
 
-from playwright.async_api import Page
-from typing import Dict, List, Any
+from collections import Counter, defaultdict
+from typing import TYPE_CHECKING, Dict, List, Any, Tuple
+import asyncio
 import json
+from sys import intern
+
+try:
+    import orjson
+except ImportError:
+    # Optional: falls back to the stdlib encoder
+    orjson = None
+
+if TYPE_CHECKING:
+    from playwright.async_api import Page
+
+# Roles reported as interactive elements
+_INTERACTIVE_ROLES = frozenset(map(intern, (
+    "button", "link", "textbox", "searchbox",
+    "checkbox", "radio", "combobox", "listbox",
+    "menuitem", "tab", "switch"
+)))
 
 class AXTreeExtractor:
     """Extracts and simplifies accessibility tree from web pages"""
@@ -13,113 +31,148 @@ class AXTreeExtractor:
     def __init__(self):
         pass
     
-    async def extract_from_page(self, page: Page, max_depth: int = 5) -> Dict[str, Any]:
+    async def extract_from_page(
+        self,
+        page: "Page",
+        max_depth: int = 5,
+        include_tree: bool = True
+    ) -> Dict[str, Any]:
         """
         Extract AXTree from a Playwright page
         Returns simplified structure optimized for AI consumption
+        include_tree=False skips building "tree" (the text representation doesn't use it)
+        The title is fetched alongside the snapshot rather than after it
         """
-        # Get the raw accessibility tree
-        snapshot = await page.accessibility.snapshot()
+        # Get the raw accessibility tree, pruned browser-side to nodes that carry meaning
+        # (explicit so a change in Playwright's default never ships the full tree over CDP)
+        snapshot, title = await asyncio.gather(
+            page.accessibility.snapshot(interesting_only=True), page.title()
+        )
         
         if not snapshot:
             return {"error": "No accessibility tree available"}
         
-        # Simplify and flatten the tree
-        simplified = self._simplify_tree(snapshot, max_depth=max_depth)
-        
-        # Extract key elements
-        interactive_elements = self._extract_interactive_elements(simplified)
+        # Simplify the tree and pick out interactive elements in one traversal
+        simplified, interactive_elements, element_counts = self._walk(
+            snapshot, max_depth=max_depth, build_tree=include_tree
+        )
         
-        return {
+        result = {
             "url": page.url,
-            "title": await page.title(),
-            "tree": simplified,
+            "title": title,
             "interactive_elements": interactive_elements,
-            "summary": self._generate_summary(simplified, interactive_elements)
+            "summary": self._generate_summary(interactive_elements, element_counts)
         }
+        if include_tree:
+            result["tree"] = simplified
+        return result
     
-    def _simplify_tree(self, node: Dict, depth: int = 0, max_depth: int = 5) -> Dict:
-        """Recursively simplify the accessibility tree"""
-        if depth > max_depth or not node:
-            return {}
-        
-        # Extract relevant info
-        simplified = {}
-        
-        if "role" in node:
-            simplified["role"] = node["role"]
-        
-        if "name" in node and node["name"]:
-            simplified["name"] = node["name"]
-        
-        if "value" in node and node["value"]:
-            simplified["value"] = node["value"]
+    def _walk(
+        self, node: Dict, max_depth: int = 5, build_tree: bool = True
+    ) -> Tuple[Dict, List[Dict], Dict[str, int]]:
+        """
+        One traversal that simplifies the tree, collects interactive elements and counts them
+        Iterative (explicit stack) so deep pages cost no Python frames or recursion limit
+        Returns (simplified tree, interactive elements in document order, count per role);
+        with build_tree=False the tree is skipped and returned as {}
+        """
+        interactive_elements = []
+        element_counts = Counter()
+        
+        # Pass 1: pre-order list of (node, parent index, role) for every node within max_depth;
+        # interactive elements are emitted here since pre-order is document order
+        order = []
+        stack = [(node, 0, -1)]
+        while stack:
+            current, depth, parent = stack.pop()
+            if depth > max_depth or not current:
+                continue
+            
+            # Each node's role arrives as a fresh string; interning collapses the copies to
+            # one object per role, so hashing and comparison hit the cached/identity paths
+            role = current.get("role")
+            if type(role) is str:
+                role = intern(role)
+            
+            index = len(order)
+            order.append((current, parent, role))
+            
+            if role in _INTERACTIVE_ROLES:
+                interactive_elements.append({
+                    "role": role,
+                    "name": current.get("name") or "",
+                    "value": current.get("value") or ""
+                })
+                element_counts[role] += 1
+            
+            children = current.get("children")
+            if children:
+                # Pushed in reverse so they pop (and get numbered) left to right
+                for child in reversed(children):
+                    stack.append((child, depth + 1, index))
         
-        if "description" in node and node["description"]:
-            simplified["description"] = node["description"]
+        if not order or not build_tree:
+            return {}, interactive_elements, element_counts
         
-        # Process children
-        if "children" in node and node["children"]:
-            children = []
-            for child in node["children"]:
-                simplified_child = self._simplify_tree(child, depth + 1, max_depth)
-                if simplified_child:
-                    children.append(simplified_child)
+        # Pass 2: build bottom-up; every descendant has a larger index than its ancestors
+        kept_children = [None] * len(order)
+        simplified = {}
+        for index in range(len(order) - 1, -1, -1):
+            current, parent, role = order[index]
+            get = current.get
+            
+            # Extract relevant info
+            simplified = {}
+            
+            if "role" in current:
+                simplified["role"] = role
+            
+            name = get("name")
+            if name:
+                simplified["name"] = name
+            
+            value = get("value")
+            if value:
+                simplified["value"] = value
             
+            description = get("description")
+            if description:
+                simplified["description"] = description
+            
+            # Siblings were collected right to left
+            children = kept_children[index]
             if children:
+                children.reverse()
                 simplified["children"] = children
-        
-        return simplified
-    
-    def _extract_interactive_elements(self, tree: Dict) -> List[Dict]:
-        """Extract all interactive elements (buttons, links, inputs)"""
-        elements = []
-        
-        interactive_roles = [
-            "button", "link", "textbox", "searchbox",
-            "checkbox", "radio", "combobox", "listbox",
-            "menuitem", "tab", "switch"
-        ]
-        
-        def traverse(node: Dict):
-            if "role" in node and node["role"] in interactive_roles:
-                element = {
-                    "role": node["role"],
-                    "name": node.get("name", ""),
-                    "value": node.get("value", "")
-                }
-                elements.append(element)
             
-            if "children" in node:
-                for child in node["children"]:
-                    traverse(child)
+            if simplified and parent >= 0:
+                if kept_children[parent] is None:
+                    kept_children[parent] = []
+                kept_children[parent].append(simplified)
         
-        traverse(tree)
-        return elements
+        # The last node built is the root
+        return simplified, interactive_elements, element_counts
     
-    def _generate_summary(self, tree: Dict, interactive_elements: List[Dict]) -> str:
+    def _generate_summary(self, interactive_elements: List[Dict], element_counts: Dict[str, int]) -> str:
         """Generate a human-readable summary of the page"""
         summary_parts = []
         
-        # Count element types
-        element_counts = {}
-        for elem in interactive_elements:
-            role = elem["role"]
-            element_counts[role] = element_counts.get(role, 0) + 1
-        
         if element_counts:
             counts_str = ", ".join([f"{count} {role}(s)" for role, count in element_counts.items()])
             summary_parts.append(f"Interactive elements: {counts_str}")
         
-        # Notable elements
-        buttons = [e for e in interactive_elements if e["role"] == "button" and e["name"]]
-        if buttons:
-            button_names = [b["name"] for b in buttons[:5]]
+        # Notable elements: named buttons and links, collected in one pass
+        names_by_role = defaultdict(list)
+        for elem in interactive_elements:
+            if elem["name"] and elem["role"] in ("button", "link"):
+                names_by_role[elem["role"]].append(elem["name"])
+        
+        button_names = names_by_role["button"][:5]
+        if button_names:
             summary_parts.append(f"Key buttons: {', '.join(button_names)}")
         
-        links = [e for e in interactive_elements if e["role"] == "link" and e["name"]]
-        if links:
-            link_names = [l["name"] for l in links[:5]]
+        link_names = names_by_role["link"][:5]
+        if link_names:
             summary_parts.append(f"Key links: {', '.join(link_names)}")
         
         return " | ".join(summary_parts) if summary_parts else "No interactive elements found"
@@ -174,10 +227,12 @@ async def test_axtree():
         print(text_repr)
         
         print("\n=== RAW AXTREE ===")
-        print(json.dumps(axtree, indent=2))
+        if orjson is not None:
+            print(orjson.dumps(axtree, option=orjson.OPT_INDENT_2).decode())
+        else:
+            print(json.dumps(axtree, indent=2))
         
         await browser.close()
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(test_axtree())
@@ -3,79 +3,186 @@ NAEYLA-XS Browser Controller
 Uses Playwright to control Chrome/Chromium
 """
 
-from playwright.async_api import async_playwright, Browser, Page
 import asyncio
-from typing import Optional, Dict, Any
+from itertools import groupby
+from typing import TYPE_CHECKING, Optional, Dict, Any, List
 
 from dsl.actions import Action, ActionType
 from env.axtree import AXTreeExtractor
 
+if TYPE_CHECKING:
+    # Playwright is imported on first start(), so importing this module stays cheap
+    from playwright.async_api import Browser, BrowserContext, Page
+
+# Batching classes for execute_actions
+_BATCH_READ = "read"      # only reads the page, safe to run concurrently
+_BATCH_SCROLL = "scroll"  # consecutive scrolls add up to one scroll
+_BATCH_STEP = "step"      # changes the page, runs in order
+
+# Common search box selectors, joined into one selector list; the first match in document
+# order wins, so every entry names a fillable element (a <div id="search"> wrapper ahead of
+# the real input would make fill() fail), and :visible (a Playwright extension) skips hidden ones
+_SEARCH_SELECTOR = ", ".join(f"{selector}:visible" for selector in [
+    'input[name="search_query"]',    # YouTube
+    'input[name="q"]',               # Google
+    'input[type="search"]',          # Generic
+    'input[aria-label*="Search" i]', # Aria labels
+    'input[placeholder*="Search" i]', # Placeholder text
+    ':is(input, textarea)#search',   # Common ID
+    ':is(input, textarea).search-input', # Common class
+])
+
+_READ_ONLY_ACTIONS = frozenset({ActionType.SCREENSHOT, ActionType.GET_TEXT, ActionType.GET_LINKS})
+
+def _batch_kind(action: Action) -> str:
+    if action.action_type in _READ_ONLY_ACTIONS:
+        return _BATCH_READ
+    if action.action_type == ActionType.SCROLL:
+        return _BATCH_SCROLL
+    return _BATCH_STEP
+
+def _scroll_offset(action: Action) -> int:
+    """Signed pixel offset of a SCROLL action (down is positive)"""
+    direction = action.params.get("direction", "down")
+    # Cast to int to prevent JS injection via string interpolation into evaluate()
+    try:
+        amount = int(action.params.get("amount", 500))
+    except (TypeError, ValueError):
+        amount = 500
+    amount = max(0, min(amount, 10000))  # clamp to a sane range
+    return amount if direction == "down" else -amount
+
 class BrowserController:
     """Controls browser using Playwright"""
     
     def __init__(self):
         self.playwright = None
-        self.browser: Optional[Browser] = None
-        self.page: Optional[Page] = None
+        self.browser: Optional["Browser"] = None
+        self.context: Optional["BrowserContext"] = None
+        self.page: Optional["Page"] = None
         self.is_running = False
         self.axtree_extractor = AXTreeExtractor()
     
     async def start(self):
         """Start browser"""
-        if self.is_running:
-            # Check if browser is actually still alive
+        if self._is_alive():
+            return  # Browser is still alive, don't restart
+        self.is_running = False
+        
+        # Only the tab was closed: open a new page in the warm context, no relaunch
+        if self.context is not None and self.browser is not None and self.browser.is_connected():
             try:
-                if self.page:
-                    await self.page.evaluate("1 + 1")
-                    return  # Browser is still alive, don't restart
-            except:
-                # Browser was closed, continue to restart
-                self.is_running = False
+                self.page = await self.context.new_page()
+                self.is_running = True
+                return
+            except Exception:
+                pass  # Context is gone too, fall through to a full launch
         
         print("🌐 Starting browser...")
-        self.playwright = await async_playwright().start()
+        # The Playwright driver survives browser restarts; only start it once
+        if self.playwright is None:
+            from playwright.async_api import async_playwright
+            self.playwright = await async_playwright().start()
         self.browser = await self.playwright.chromium.launch(headless=False)
         
         # Listen for browser close event
         self.browser.on("disconnected", lambda: self._on_browser_closed())
         
-        self.page = await self.browser.new_page()
+        self.context = await self.browser.new_context()
+        self.page = await self.context.new_page()
         self.is_running = True
         print("✅ Browser ready!")
     
+    def _is_alive(self) -> bool:
+        """
+        Local liveness check, no browser round-trip
+        The "disconnected" handler clears is_running; is_closed() catches a closed tab
+        """
+        return (
+            self.is_running
+            and self.browser is not None
+            and self.browser.is_connected()
+            and self.page is not None
+            and not self.page.is_closed()
+        )
+    
     def _on_browser_closed(self):
         """Called when browser is closed manually"""
         print("🛑 Browser was closed")
         self.is_running = False
         self.browser = None
+        self.context = None
         self.page = None
     
     async def stop(self):
         """Stop browser"""
-        if not self.is_running:
+        if self.playwright is None:
             return
         
-        await self.browser.close()
+        # The driver outlives a manually closed browser, so it is stopped either way
+        if self.browser is not None:
+            await self.browser.close()
         await self.playwright.stop()
+        self.playwright = None
+        self.browser = None
+        self.context = None
+        self.page = None
         self.is_running = False
         print("🛑 Browser stopped")
     
     async def execute_action(self, action: Action) -> Dict[str, Any]:
         """Execute a single action"""
-        # Check if browser needs to be restarted
-        if not self.is_running or self.browser is None:
+        # Restart the browser if it (or its page) was closed
+        if not self._is_alive():
             await self.start()
         
-        # Try to check if browser is still alive
-        try:
-            if self.page:
-                # Test if page is still responsive
-                await self.page.evaluate("1 + 1")
-        except:
-            # Browser was closed manually, restart it
-            self.is_running = False
-            await self.start()
+        return await self._run_action(action)
+    
+    async def execute_actions(self, actions: List[Action]) -> List[Dict[str, Any]]:
+        """
+        Execute a plan of actions and return one result per action, in order
+        - contiguous read-only actions run concurrently on the page
+        - contiguous scrolls are coalesced into a single scrollBy
+        - everything else runs in order, waiting for the page to settle between steps
+        """
+        results = []
+        
+        for i, (kind, group) in enumerate(groupby(actions, key=_batch_kind)):
+            group = list(group)
+            if i > 0:
+                await self.wait_ready(timeout_ms=2000)
+            
+            # Local check only, so it is cheap to repeat per group (an action may close the page)
+            if not self._is_alive():
+                await self.start()
+            
+            if kind == _BATCH_READ:
+                results.extend(await asyncio.gather(*(self._run_action(a) for a in group)))
+            elif kind == _BATCH_SCROLL:
+                result = await self._scroll_by(sum(_scroll_offset(a) for a in group))
+                results.extend(dict(result) for _ in group)
+            else:
+                for k, action in enumerate(group):
+                    if k > 0:
+                        await self.wait_ready(timeout_ms=2000)
+                    results.append(await self._run_action(action))
         
+        return results
+    
+    async def _scroll_by(self, offset: int) -> Dict[str, Any]:
+        """Scroll the page vertically by offset pixels (negative scrolls up)"""
+        result = {"success": False, "data": None, "error": None}
+        try:
+            await self.page.evaluate("(n) => window.scrollBy(0, n)", offset)
+            result["success"] = True
+        except Exception as e:
+            result["error"] = str(e)
+            if "Target page, context or browser has been closed" in str(e):
+                self.is_running = False
+        return result
+    
+    async def _run_action(self, action: Action) -> Dict[str, Any]:
+        """Execute a single action on the current page (liveness already checked)"""
         result = {"success": False, "data": None, "error": None}
         
         try:
@@ -91,36 +198,21 @@ class BrowserController:
                 # Wait for page to load
                 await asyncio.sleep(1)
                 
-                # Try common search box selectors
-                search_selectors = [
-                    'input[name="search_query"]',  # YouTube
-                    'input[name="q"]',              # Google
-                    'input[type="search"]',         # Generic
-                    'input[aria-label*="Search" i]', # Aria labels
-                    'input[placeholder*="Search" i]', # Placeholder text
-                    '#search',                      # Common ID
-                    '.search-input',                # Common class
-                ]
-                
-                search_found = False
-                for selector in search_selectors:
-                    try:
-                        # Check if selector exists
-                        element = await self.page.query_selector(selector)
-                        if element:
-                            # Focus and type
-                            await self.page.fill(selector, query)
-                            # Press Enter to search
-                            await self.page.keyboard.press('Enter')
-                            search_found = True
-                            result["success"] = True
-                            result["data"] = {"query": query, "selector": selector}
-                            print(f"🔍 Searched for '{query}' using selector: {selector}")
-                            break
-                    except:
-                        continue
+                try:
+                    # One union selector resolves every candidate in a single round-trip;
+                    # the first match in document order wins
+                    element = await self.page.query_selector(_SEARCH_SELECTOR)
+                except Exception:
+                    element = None
                 
-                if not search_found:
+                if element:
+                    # Focus and type, then press Enter to search
+                    await element.fill(query)
+                    await element.press('Enter')
+                    result["success"] = True
+                    result["data"] = {"query": query}
+                    print(f"🔍 Searched for '{query}'")
+                else:
                     result["error"] = "Could not find search box on page"
             
             elif action.action_type == ActionType.CLICK:
@@ -146,17 +238,7 @@ class BrowserController:
                 result["data"] = {"text": text}
             
             elif action.action_type == ActionType.SCROLL:
-                direction = action.params.get("direction", "down")
-                # Cast to int to prevent JS injection via string interpolation into evaluate()
-                try:
-                    amount = int(action.params.get("amount", 500))
-                except (TypeError, ValueError):
-                    amount = 500
-                amount = max(0, min(amount, 10000))  # clamp to a sane range
-                if direction == "down":
-                    await self.page.evaluate("(n) => window.scrollBy(0, n)", amount)
-                else:
-                    await self.page.evaluate("(n) => window.scrollBy(0, -n)", amount)
+                await self.page.evaluate("(n) => window.scrollBy(0, n)", _scroll_offset(action))
                 result["success"] = True
             
         except Exception as e:
@@ -167,6 +249,17 @@ class BrowserController:
         
         return result
     
+    async def wait_ready(self, timeout_ms: int = 2000):
+        """Wait for the page to go network-idle, giving up after timeout_ms"""
+        if not self.page:
+            return
+        
+        try:
+            await self.page.wait_for_load_state("networkidle", timeout=timeout_ms)
+        except Exception:
+            # Pages with long-polling never go idle; the timeout is the upper bound
+            pass
+    
     async def get_page_context(self) -> Dict[str, Any]:
         """Get current page context (title, URL, etc.)"""
         if not self.page:
@@ -180,23 +273,28 @@ class BrowserController:
         except:
             return {}
     
-    async def get_page_perception(self) -> Dict[str, Any]:
-        """Get AI-readable representation of current page"""
+    async def get_page_perception(self, include_tree: bool = False) -> Dict[str, Any]:
+        """
+        Get AI-readable representation of current page
+        The "axtree" dict is only built and returned with include_tree=True
+        """
         if not self.page:
             return {"error": "No page loaded"}
         
         try:
             # Extract AXTree
-            axtree = await self.axtree_extractor.extract_from_page(self.page)
+            axtree = await self.axtree_extractor.extract_from_page(self.page, include_tree=include_tree)
             
             # Get text representation for AI
             text_repr = self.axtree_extractor.to_text_representation(axtree)
             
-            return {
+            perception = {
                 "success": True,
-                "axtree": axtree,
                 "text": text_repr
             }
+            if include_tree:
+                perception["axtree"] = axtree
+            return perception
         except Exception as e:
             return {
                 "success": False,
@@ -3,8 +3,110 @@ Parse user messages for action intent and generate actions
 """
 
 import re
-from typing import List, Optional, Tuple
-from dsl.actions import Action, ActionType
+from functools import lru_cache
+from typing import FrozenSet, List, Optional, Tuple
+from dsl.actions import Action, ActionType, iter_action_tags
+
+try:
+    import ahocorasick
+except ImportError:
+    # Optional: without pyahocorasick the scan falls back to one substring check per keyword
+    ahocorasick = None
+
+# Routing tags produced by scan_message
+TRIGGER_BROWSER = "browser"  # message asks for a browser action
+TRIGGER_PAGE = "page"        # message refers to the current page (attach perception)
+
+_ROUTING_KEYWORDS = {
+    TRIGGER_BROWSER: (
+        'go to', 'open', 'visit', 'navigate',
+        'search for', 'search', 'look up', 'find',
+        'youtube', 'google', 'website',
+        'what do you see', 'describe the page',
+        'what\'s on the page', 'read the page'
+    ),
+    TRIGGER_PAGE: ('see', 'page'),
+}
+
+# keyword -> every tag it signals
+_KEYWORD_TAGS = {}
+for _tag, _keywords in _ROUTING_KEYWORDS.items():
+    for _keyword in _keywords:
+        _KEYWORD_TAGS[_keyword] = _KEYWORD_TAGS.get(_keyword, frozenset()) | {_tag}
+_TAG_COUNT = len(_ROUTING_KEYWORDS)
+
+if ahocorasick is not None:
+    _AUTOMATON = ahocorasick.Automaton()
+    for _keyword, _tags in _KEYWORD_TAGS.items():
+        _AUTOMATON.add_word(_keyword, _tags)
+    _AUTOMATON.make_automaton()
+    _KEYWORD_RE = None
+else:
+    _AUTOMATON = None
+    # Fallback: one C-level scan; the lookahead reports overlapping hits ("see" inside
+    # "what do you see") and longest-first alternatives win where keywords share a start
+    _KEYWORD_RE = re.compile('(?=({}))'.format(
+        '|'.join(re.escape(k) for k in sorted(_KEYWORD_TAGS, key=len, reverse=True))
+    ))
+
+# Simple navigation ("go to X"), tried in this order, then standalone search ("search for X");
+# a verb earlier in the list wins wherever it sits in the message. Matched against the
+# lowercased message, which _normalize_url and the emitted params rely on, so no IGNORECASE
+_NAV_RES = tuple(re.compile(pattern) for pattern in (
+    r'go\s+to\s+(.+)',
+    r'open\s+(.+)',
+    r'visit\s+(.+)',
+    r'navigate\s+to\s+(.+)',
+))
+_SEARCH_RE = re.compile(r'search\s+(?:for\s+)?(.+)')
+
+# Every action pattern below needs one of these substrings ("go" covers "go<space>to"), so a
+# message without any of them skips the regexes entirely
+_ACTION_LITERALS = ('go', 'open', 'visit', 'navigate', 'search')
+
+# Trailing "and search..." / "and look for..." on a navigation target
+_URL_TAIL_RE = re.compile(r'\s+and\s+(search|look|find).*$')
+
+# Compound actions: "go to SITE and search QUERY", then "search QUERY on SITE"
+_COMPOUND_NAV_SEARCH_RE = re.compile(
+    r'(?:go\s+to|open|visit)\s+([^\s]+)(?:\s+and\s+|\s+then\s+)(?:search|look\s+for|find)\s+(.+)'
+)
+_COMPOUND_SEARCH_ON_RE = re.compile(r'search\s+(?:for\s+)?(.+?)\s+(?:on|in)\s+(.+)')
+
+# Lowercased copy of a message, shared by scan_message and extract_actions_from_message so a
+# chat turn lowercases its message once; str caches its own hash, so a hit costs no rescan
+_lower = lru_cache(maxsize=256)(str.lower)
+
+# Whitespace and sentence punctuation trimmed off a navigation target in one strip() call
+_URL_TRIM = ' \t\n\r?.,!'
+
+# Site names that map to a fixed homepage when they appear anywhere in a bare target
+_KNOWN_SITES = {
+    'youtube': 'https://youtube.com',
+    'google': 'https://google.com',
+    'twitter': 'https://twitter.com',
+    'github': 'https://github.com',
+    'reddit': 'https://reddit.com',
+}
+
+def strip_and_extract_actions(text: str) -> Tuple[str, List[Action]]:
+    """
+    Split model output into (text without action tags, parsed actions) in one pass
+    Same results as stripping the tags and calling parse_action_from_text separately,
+    since both run on the same tag scan (dsl.actions.iter_action_tags)
+    """
+    pieces = []
+    actions = []
+    last = 0
+    
+    for start, end, action in iter_action_tags(text):
+        pieces.append(text[last:start])
+        last = end
+        if action is not None:
+            actions.append(action)
+    
+    pieces.append(text[last:])
+    return "".join(pieces).strip(), actions
 
 def extract_actions_from_message(message: str, response: str = "") -> List[Action]:
     """
@@ -15,48 +117,45 @@ def extract_actions_from_message(message: str, response: str = "") -> List[Actio
     if "<|action|>" in response:
         return []
     
-    message_lower = message.lower()
+    message_lower = _lower(message)
     actions = []
     
+    # Most chat messages contain no action verb at all; substring checks are far cheaper
+    # than running the patterns to find that out
+    if not any(literal in message_lower for literal in _ACTION_LITERALS):
+        return actions
+    
     # Check for compound actions (navigate + search)
     compound_action = _parse_compound_action(message_lower)
     if compound_action:
         return compound_action
     
-    # Simple navigation patterns
-    navigation_patterns = [
-        (r'go to (.+)', lambda m: m.group(1)),
-        (r'open (.+)', lambda m: m.group(1)),
-        (r'visit (.+)', lambda m: m.group(1)),
-        (r'navigate to (.+)', lambda m: m.group(1)),
-    ]
-    
-    for pattern, url_extractor in navigation_patterns:
-        match = re.search(pattern, message_lower)
-        if match:
-            url = url_extractor(match)
-            
-            # Clean up the URL
-            url = url.strip().rstrip('?.,!').strip()
-            
-            # Remove "and search..." or "and look for..." from URL
-            url = re.sub(r'\s+and\s+(search|look|find).*$', '', url)
-            
-            # Add protocol if missing
-            url = _normalize_url(url)
-            
-            actions.append(Action(
-                action_type=ActionType.NAVIGATE,
-                params={"url": url},
-                reasoning=f"User asked to navigate to {url}"
-            ))
+    for pattern in _NAV_RES:
+        match = pattern.search(message_lower)
+        if match is not None:
             break
     
-    # Standalone search (just "search for X")
-    if not actions:
-        search_match = re.search(r'search (?:for )?(.+)', message_lower)
-        if search_match:
-            query = search_match.group(1).strip()
+    if match is not None:
+        url = match.group(1)
+        
+        # Clean up the URL
+        url = url.strip(_URL_TRIM)
+        
+        # Remove "and search..." or "and look for..." from URL
+        url = _URL_TAIL_RE.sub('', url)
+        
+        # Add protocol if missing
+        url = _normalize_url(url)
+        
+        actions.append(Action(
+            action_type=ActionType.NAVIGATE,
+            params={"url": url},
+            reasoning=f"User asked to navigate to {url}"
+        ))
+    else:
+        match = _SEARCH_RE.search(message_lower)
+        if match is not None:
+            query = match.group(1).strip()
             actions.append(Action(
                 action_type=ActionType.SEARCH,
                 params={"query": query},
@@ -71,9 +170,13 @@ def _parse_compound_action(message: str) -> Optional[List[Action]]:
     Parse compound actions like "go to youtube and search car videos"
     Returns list of actions or None
     """
+    # Each pattern needs its glue word; the whitespace around it varies (\s+), so the
+    # pretests look for the bare words and skip the regex scan when they are absent
+    
     # Pattern: "go to SITE and search QUERY"
-    pattern = r'(?:go to|open|visit)\s+([^\s]+)(?:\s+and\s+|\s+then\s+)(?:search|look for|find)\s+(.+)'
-    match = re.search(pattern, message)
+    match = None
+    if 'and' in message or 'then' in message:
+        match = _COMPOUND_NAV_SEARCH_RE.search(message)
     
     if match:
         site = match.group(1).strip()
@@ -96,8 +199,9 @@ def _parse_compound_action(message: str) -> Optional[List[Action]]:
         ]
     
     # Pattern: "search QUERY on SITE"
-    pattern2 = r'search\s+(?:for\s+)?(.+?)\s+(?:on|in)\s+(.+)'
-    match2 = re.search(pattern2, message)
+    match2 = None
+    if 'search' in message:
+        match2 = _COMPOUND_SEARCH_ON_RE.search(message)
     
     if match2:
         query = match2.group(1).strip()
@@ -122,37 +226,43 @@ def _parse_compound_action(message: str) -> Optional[List[Action]]:
 
 def _normalize_url(url: str) -> str:
     """Normalize a URL string"""
-    url = url.strip().rstrip('?.,!').strip()
+    url = url.strip(_URL_TRIM)
     
     # Add protocol if missing
     if not url.startswith('http'):
-        # Common sites
-        if 'youtube' in url or url == 'youtube':
-            return 'https://youtube.com'
-        elif 'google' in url or url == 'google':
-            return 'https://google.com'
-        elif 'twitter' in url or url == 'twitter':
-            return 'https://twitter.com'
-        elif 'github' in url or url == 'github':
-            return 'https://github.com'
-        elif 'reddit' in url or url == 'reddit':
-            return 'https://reddit.com'
-        else:
-            # Try adding https://
-            return f'https://{url}'
+        # Common sites; first match in insertion order wins
+        for name, site_url in _KNOWN_SITES.items():
+            if name in url:
+                return site_url
+        # Try adding https://
+        return f'https://{url}'
     
     return url
 
 
+@lru_cache(maxsize=1024)
+def scan_message(message: str) -> FrozenSet[str]:
+    """
+    Find every routing tag whose keywords occur in the message
+    One Aho-Corasick pass covers the whole vocabulary, and it stops as soon as every
+    tag has been seen
+    """
+    # Collapse whitespace runs so multi-word keywords ("go to") match any spacing, as the
+    # \s+ gaps in the action patterns do; router and parser then agree on a message
+    message_lower = " ".join(_lower(message).split())
+    matches = (
+        _AUTOMATON.iter(message_lower) if _AUTOMATON is not None
+        else ((None, _KEYWORD_TAGS[m.group(1)]) for m in _KEYWORD_RE.finditer(message_lower))
+    )
+    
+    hits = set()
+    for _, tags in matches:
+        hits |= tags
+        if len(hits) == _TAG_COUNT:
+            break
+    return frozenset(hits)
+
+
 def should_trigger_browser(message: str) -> bool:
     """Check if message indicates browser action needed"""
-    keywords = [
-        'go to', 'open', 'visit', 'navigate',
-        'search for', 'search', 'look up', 'find',
-        'youtube', 'google', 'website',
-        'what do you see', 'describe the page',
-        'what\'s on the page', 'read the page'
-    ]
-    
-    message_lower = message.lower()
-    return any(keyword in message_lower for keyword in keywords)
+    return TRIGGER_BROWSER in scan_message(message)
@@ -2,29 +2,151 @@
 NAEYLA-XS Model Backbone (Qwen 2.5-3B with MLX)
 """
 
+import os
+import copy
+import inspect
+import json
+import shutil
+import hashlib
+from collections import OrderedDict
 import mlx.core as mx
-from mlx_lm import load, generate
+from mlx_lm import load, generate, stream_generate
+from mlx_lm.models.cache import make_prompt_cache
+from mlx_lm.utils import quantize_model
 from pathlib import Path
+from typing import Any, Iterator, List, Optional, Tuple, Union
+
+from model.browser_prompts import get_browser_prompt
+from model.tokens import MODE_DESCRIPTIONS, get_mode_prompt
+
+try:
+    from mlx_lm import batch_generate
+    from mlx_lm.generate import BatchResponse
+except ImportError:
+    # Older mlx-lm releases have no batched generation; fall back to one-by-one
+    batch_generate = BatchResponse = None
+
+# Per-prompt starting caches (and returning them) came after batch_generate itself
+_BATCH_CACHES = batch_generate is not None and "prompt_caches" in inspect.signature(batch_generate).parameters
+
+# Returned token ids came later still (mlx-lm 0.29.1 - 0.31 have caches but not ids, and
+# pass unknown keywords on to BatchGenerator, which raises); storing a conversation needs
+# them to tell a stopped reply from a cut-off one
+_BATCH_TOKEN_IDS = (
+    _BATCH_CACHES
+    and "return_token_ids" in inspect.signature(batch_generate).parameters
+    and "token_ids" in getattr(BatchResponse, "__dataclass_fields__", ())
+)
+
+# Weight precision: 4 or 8 (bits), or "none" to load the checkpoint as shipped.
+# Decode is memory-bandwidth bound, so fewer bytes per weight means more tokens/sec.
+NAEYLA_QUANT = os.getenv("NAEYLA_QUANT", "4")
+QUANT_CACHE_DIR = Path.home() / ".cache" / "naeyla"
+
+_ASSISTANT_TAG = "<|im_start|>assistant"
+
+
+def _is_quantized(model_path: Path) -> bool:
+    """True if the checkpoint at model_path already carries quantized weights"""
+    try:
+        config = json.loads((model_path / "config.json").read_text())
+    except (OSError, ValueError):
+        return False
+    return "quantization" in config or "quantization_config" in config
+
+
+def resolve_model_path(model_path: Path, quant: str = NAEYLA_QUANT) -> Path:
+    """
+    Return a path to weights at the requested precision
+    Unquantized checkpoints are converted once into QUANT_CACHE_DIR and reused after;
+    if that directory can't be written, the original path comes back and load_model
+    quantizes in memory instead
+    """
+    if quant not in ("4", "8", "none"):
+        raise ValueError(f"NAEYLA_QUANT must be 4, 8 or none (got {quant!r})")
+    if quant == "none" or _is_quantized(model_path):
+        return model_path
+    
+    bits = int(quant)
+    quant_path = QUANT_CACHE_DIR / f"{model_path.name}-q{bits}"
+    if not (quant_path / "config.json").exists():
+        from mlx_lm import convert
+        
+        print(f"⚙️  Quantizing {model_path} to {bits}-bit (one-time)...")
+        # convert() refuses to write into an existing directory (e.g. an interrupted run)
+        shutil.rmtree(quant_path, ignore_errors=True)
+        try:
+            quant_path.parent.mkdir(parents=True, exist_ok=True)
+            convert(str(model_path), mlx_path=str(quant_path), quantize=True, q_bits=bits, q_group_size=64)
+        except OSError as e:
+            print(f"⚠️  Could not write {quant_path} ({e}); quantizing in memory instead")
+            shutil.rmtree(quant_path, ignore_errors=True)
+            return model_path
+    
+    return quant_path
+
+
+def load_model(model_path: Path, quant: str = NAEYLA_QUANT) -> Tuple[Any, Any]:
+    """
+    Load model and tokenizer, quantizing in memory if the weights are still full precision
+    The weights load lazily, so only the quantized copy is ever materialized
+    """
+    if quant == "none" or _is_quantized(model_path):
+        return load(str(model_path))
+    
+    model, tokenizer, config = load(str(model_path), lazy=True, return_config=True)
+    model, _ = quantize_model(model, config, group_size=64, bits=int(quant))
+    mx.eval(model.parameters())
+    return model, tokenizer
+
 
 class NaeylaBackbone:
     """Qwen 2.5-3B backbone for NAEYLA-XS"""
 
-    def __init__(self, model_path: str = "models/qwen2.5-3b"):
-        """Load the model"""
+    # Number of prefilled system prompts (mode x browser) kept in memory
+    PREFIX_CACHE_SIZE = 8
+    
+    # Conversations longer than this start over from the system prompt
+    MAX_CONVERSATION_TOKENS = 4096
+    
+    # Reply length cap per turn
+    MAX_NEW_TOKENS = 512
+
+    def __init__(self, model_path: str = "models/qwen2.5-3b", kv_store: Optional[Any] = None):
+        """
+        Load the model
+        kv_store (get/put of prompt caches by key) enables multi-turn conversation reuse
+        """
         print("🧠 Loading Naeyla backbone...")
         
-        self.model_path = Path(model_path)
+        self.model_path = resolve_model_path(Path(model_path))
         
         # Load model and tokenizer with MLX
-        self.model, self.tokenizer = load(str(self.model_path))
+        self.model, self.tokenizer = load_model(self.model_path)
+        
+        # (mode, system prompt hash) -> KV cache holding the prefilled system prompt
+        self._prefix_cache: "OrderedDict[Tuple[str, int], List[Any]]" = OrderedDict()
+        self.kv_store = kv_store
+        self._im_end_ids = self.tokenizer.encode("<|im_end|>")
         
-        print(f"✅ Model loaded from {model_path}")
+        # (mode, browser flag) -> system prompt text and token ids; the prompts are static,
+        # so each is rendered and tokenized once instead of on every turn
+        self._system_prefixes = {}
+        self._system_prefix_ids = {}
+        for mode in MODE_DESCRIPTIONS:
+            for browser_enabled in (False, True):
+                system_prefix = self._render_system_prefix(mode, browser_enabled)
+                self._system_prefixes[mode, browser_enabled] = system_prefix
+                self._system_prefix_ids[mode, browser_enabled] = self.tokenizer.encode(system_prefix)
+        
+        print(f"✅ Model loaded from {self.model_path}")
         
     def generate_text(
         self, 
-        prompt: str, 
+        prompt: Union[str, List[int]], 
         max_tokens: int = 512,
         temperature: float = 0.7,
+        prompt_cache: Optional[List[Any]] = None,
     ) -> str:
         """Generate text response"""
         response = generate(
@@ -32,42 +154,301 @@ class NaeylaBackbone:
             self.tokenizer,
             prompt=prompt,
             max_tokens=max_tokens,
-            verbose=False
+            verbose=False,
+            prompt_cache=prompt_cache
         )
         return response
     
-    def chat(
-        self,
-        message: str,
-        mode: str = "companion",
-        browser_enabled: bool = False
-    ) -> str:
-        """Chat with mode conditioning"""
+    def _render_system_prefix(self, mode: str, browser_enabled: bool) -> str:
+        """Build the system part of the Qwen chat template (identical across turns)"""
         if browser_enabled:
-            from model.browser_prompts import get_browser_prompt
             mode_prompt = get_browser_prompt(mode)
         else:
-            from model.tokens import get_mode_prompt
             mode_prompt = get_mode_prompt(mode)
         
-        # Qwen chat template
-        prompt = f"""<|im_start|>system
+        return f"""<|im_start|>system
 {mode_prompt}
 You are Naeyla, a personal AI assistant. Be helpful, warm, and concise.<|im_end|>
-<|im_start|>user
+"""
+    
+    def _user_turn(self, message: str) -> str:
+        """Build the user part of the Qwen chat template"""
+        return f"""<|im_start|>user
 {message}<|im_end|>
 <|im_start|>assistant
 """
+    
+    def _system_prefix(self, mode: str, browser_enabled: bool) -> str:
+        """Precomputed system prefix; unknown modes are rendered on the fly"""
+        system_prefix = self._system_prefixes.get((mode, browser_enabled))
+        if system_prefix is None:
+            system_prefix = self._render_system_prefix(mode, browser_enabled)
+        return system_prefix
+    
+    def _prompt_ids(self, message: str, mode: str, browser_enabled: bool) -> List[int]:
+        """
+        Token ids of the Qwen chat-template prompt for a single turn
+        The user turn opens with a special token, so tokenizing it on its own lines up
+        with the precomputed system prefix ids
+        """
+        prefix_ids = self._system_prefix_ids.get((mode, browser_enabled))
+        if prefix_ids is None:
+            prefix_ids = self.tokenizer.encode(self._render_system_prefix(mode, browser_enabled))
+        return prefix_ids + self.tokenizer.encode(self._user_turn(message))
+    
+    def _get_prefix_cache(self, mode: str, system_prefix: str) -> List[Any]:
+        """
+        Return a private copy of the KV cache for a system prompt
+        The prefill runs once per prompt; later turns only pay for their own tokens
+        """
+        # Generation appends to the cache in place, so never hand out the shared one
+        return copy.deepcopy(self._shared_prefix_cache(mode, system_prefix))
+    
+    def _shared_prefix_cache(self, mode: str, system_prefix: str) -> List[Any]:
+        """The prefix cache entry itself, prefilled on first use; callers must not extend it"""
+        key = (mode, hash(system_prefix))
+        cache = self._prefix_cache.get(key)
+        
+        if cache is None:
+            cache = make_prompt_cache(self.model)
+            tokens = mx.array(self.tokenizer.encode(system_prefix))
+            self.model(tokens[None], cache=cache)
+            mx.eval([c.state for c in cache])
+            
+            self._prefix_cache[key] = cache
+            if len(self._prefix_cache) > self.PREFIX_CACHE_SIZE:
+                self._prefix_cache.popitem(last=False)
+        else:
+            self._prefix_cache.move_to_end(key)
+        
+        return cache
+    
+    def prefetch_turn(self, mode: str, browser_enabled: bool, conversation_id: Optional[str] = None):
+        """
+        Get a turn's starting KV state ready before its message is known: a stored
+        conversation is pulled from SSD into RAM, otherwise the system prompt is prefilled
+        Meant to run while the caller still waits on the message's context
+        """
+        if conversation_id and self.kv_store is not None:
+            if self.kv_store.prefetch(self._conversation_key(conversation_id, mode)):
+                return
+        self._shared_prefix_cache(mode, self._system_prefix(mode, browser_enabled))
+    
+    def _extract_response(self, response: str) -> str:
+        """Extract the assistant turn from raw generated text"""
+        # Slice between the last assistant header and the next <|im_end|>; no split lists
+        start = response.rfind(_ASSISTANT_TAG)
+        start = 0 if start == -1 else start + len(_ASSISTANT_TAG)
+        end = response.find("<|im_end|>", start)
+        if end == -1:
+            end = len(response)
+        
+        return response[start:end].strip()
+    
+    def _conversation_key(self, conversation_id: str, mode: str) -> str:
+        """
+        Stable store key: one KV history per conversation and mode
+        The browser flag is set per message, so it is left out; the hash covers both of
+        the mode's system prompts so a prompt change starts a new cached conversation
+        """
+        prompts = self._system_prefix(mode, False) + self._system_prefix(mode, True)
+        prompt_hash = hashlib.sha256(prompts.encode("utf-8")).hexdigest()[:16]
+        return f"{conversation_id}:{mode}:{prompt_hash}"
+    
+    def _prepare_turn(
+        self,
+        message: str,
+        mode: str,
+        browser_enabled: bool,
+        conversation_id: Optional[str]
+    ) -> Tuple[List[int], List[Any], Optional[str]]:
+        """
+        Pick the starting KV cache for a turn and tokenize what still needs prefill
+        A conversation keeps the system prompt of its first turn; later turns resume
+        its history whatever their browser flag (keyword actions still run for them)
+        """
+        user_turn = self._user_turn(message)
+        
+        store_key = None
+        prompt_cache = None
+        if conversation_id and self.kv_store is not None:
+            store_key = self._conversation_key(conversation_id, mode)
+            prompt_cache = self.kv_store.get(store_key)
+            if prompt_cache is not None:
+                # Stored caches already end with the last reply's <|im_end|> (see _finish_turn)
+                user_turn = "\n" + user_turn
+        
+        if prompt_cache is None:
+            # The system prompt comes from the prefix cache; only the user turn is prefilled
+            system_prefix = self._system_prefix(mode, browser_enabled)
+            prompt_cache = self._get_prefix_cache(mode, system_prefix)
+        
+        return self.tokenizer.encode(user_turn), prompt_cache, store_key
+    
+    def _finish_turn(self, store_key: Optional[str], prompt_cache: List[Any], stopped: bool):
+        """
+        Hand a conversation's KV cache back to the store
+        A reply that ended on its stop token already fed <|im_end|> into the cache;
+        one cut off (max tokens, abandoned stream) is closed here so every stored
+        conversation ends the same way
+        """
+        if store_key is None:
+            return
+        if prompt_cache[0].offset >= self.MAX_CONVERSATION_TOKENS:
+            self.kv_store.discard(store_key)
+            return
+        if not stopped:
+            self.model(mx.array(self._im_end_ids)[None], cache=prompt_cache)
+            mx.eval([c.state for c in prompt_cache])
+        self.kv_store.put(store_key, prompt_cache)
+    
+    def _stream_turn(self, prompt: List[int], prompt_cache: List[Any], store_key: Optional[str]) -> Iterator[str]:
+        """Decode one prepared turn, yielding text segments, then store its KV cache"""
+        finish_reason = None
+        try:
+            for chunk in stream_generate(
+                self.model,
+                self.tokenizer,
+                prompt=prompt,
+                max_tokens=self.MAX_NEW_TOKENS,
+                prompt_cache=prompt_cache
+            ):
+                finish_reason = chunk.finish_reason
+                yield chunk.text
+        finally:
+            self._finish_turn(store_key, prompt_cache, stopped=finish_reason == "stop")
+    
+    def chat(
+        self,
+        message: str,
+        mode: str = "companion",
+        browser_enabled: bool = False,
+        conversation_id: Optional[str] = None
+    ) -> str:
+        """Chat with mode conditioning"""
+        prompt, prompt_cache, store_key = self._prepare_turn(
+            message, mode, browser_enabled, conversation_id
+        )
         
         # Generate
-        response = self.generate_text(prompt=prompt, max_tokens=512, temperature=0.7)
+        response = "".join(self._stream_turn(prompt, prompt_cache, store_key))
         
-        # Extract assistant response
-        if "<|im_start|>assistant" in response:
-            response = response.split("<|im_start|>assistant")[-1]
-        response = response.split("<|im_end|>")[0].strip()
+        return self._extract_response(response)
+    
+    def chat_stream(
+        self,
+        message: str,
+        mode: str = "companion",
+        browser_enabled: bool = False,
+        conversation_id: Optional[str] = None
+    ) -> Iterator[str]:
+        """Chat with mode conditioning, yielding text segments as they are decoded"""
+        prompt, prompt_cache, store_key = self._prepare_turn(
+            message, mode, browser_enabled, conversation_id
+        )
         
-        return response
+        yield from self._stream_turn(prompt, prompt_cache, store_key)
+    
+    def chat_batch(
+        self,
+        messages: List[str],
+        modes: List[str],
+        browser_flags: Optional[List[bool]] = None,
+        conversation_ids: Optional[List[Optional[str]]] = None
+    ) -> List[str]:
+        """
+        Chat over several messages in one batched generation
+        Weights are read once per decode step for the whole batch
+        """
+        if browser_flags is None:
+            browser_flags = [False] * len(messages)
+        if conversation_ids is None:
+            conversation_ids = [None] * len(messages)
+        
+        # Without per-prompt caches and returned token ids a conversation can't resume inside a
+        # batch; two turns of one conversation must run in order either way
+        ids = [conversation_id for conversation_id in conversation_ids if conversation_id]
+        if (
+            len(messages) == 1 or batch_generate is None
+            or (ids and not _BATCH_TOKEN_IDS) or len(set(ids)) < len(ids)
+        ):
+            return [
+                self.chat(message, mode, browser_enabled, conversation_id)
+                for message, mode, browser_enabled, conversation_id
+                in zip(messages, modes, browser_flags, conversation_ids)
+            ]
+        
+        if not _BATCH_CACHES:
+            prompts = [
+                self._prompt_ids(message, mode, browser_enabled)
+                for message, mode, browser_enabled in zip(messages, modes, browser_flags)
+            ]
+            result = batch_generate(
+                self.model,
+                self.tokenizer,
+                prompts=prompts,
+                max_tokens=self.MAX_NEW_TOKENS,
+                verbose=False
+            )
+            return [self._extract_response(text) for text in result.texts]
+        
+        # Each turn starts from its prefilled system prompt or its conversation's KV cache,
+        # so only the new user turns are prefilled
+        turns = []
+        try:
+            for message, mode, browser_enabled, conversation_id in zip(
+                messages, modes, browser_flags, conversation_ids
+            ):
+                turns.append(self._prepare_turn(message, mode, browser_enabled, conversation_id))
+            # Only conversations need their caches and token ids back; asking for them
+            # otherwise would also break on releases without return_token_ids
+            returns = {"return_prompt_caches": True, "return_token_ids": True} if ids else {}
+            result = batch_generate(
+                self.model,
+                self.tokenizer,
+                prompts=[prompt for prompt, _, _ in turns],
+                prompt_caches=[prompt_cache for _, prompt_cache, _ in turns],
+                max_tokens=self.MAX_NEW_TOKENS,
+                verbose=False,
+                **returns
+            )
+        except BaseException:
+            # Checked-out conversation caches may be partly prefilled; drop them so the
+            # conversation starts over instead of silently resuming an older SSD snapshot
+            for _, _, store_key in turns:
+                if store_key is not None:
+                    self.kv_store.discard(store_key)
+            raise
+        
+        if ids:
+            # Token ids exclude the stop token, so a reply under the cap ended on it
+            for (_, _, store_key), prompt_cache, token_ids in zip(turns, result.caches, result.token_ids):
+                self._finish_turn(store_key, prompt_cache, stopped=len(token_ids) < self.MAX_NEW_TOKENS)
+        return [self._extract_response(text) for text in result.texts]
+    
+    def warmup(self, max_batch: int = 1):
+        """
+        Prefill every mode's system prompt and run throwaway generations
+        so kernel compilation happens before the first real request, not during it
+        """
+        for mode in MODE_DESCRIPTIONS:
+            for browser_enabled in (False, True):
+                self._get_prefix_cache(mode, self._system_prefix(mode, browser_enabled))
+        
+        # Single-request decode path (prefix cache + user turn)
+        prompt, prompt_cache, _ = self._prepare_turn("hi", "companion", False, None)
+        self.generate_text(prompt=prompt, max_tokens=4, prompt_cache=prompt_cache)
+        
+        # Batched decode path at the largest batch the server will form
+        if batch_generate is not None and max_batch > 1:
+            prompt = self._prompt_ids("hi", "companion", False)
+            batch_generate(
+                self.model,
+                self.tokenizer,
+                prompts=[prompt] * max_batch,
+                max_tokens=4,
+                verbose=False
+            )
 
 
 # Test function
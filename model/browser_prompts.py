@@ -2,6 +2,8 @@
 Browser action prompts for Naeyla
 """
 
+from model.tokens import get_mode_prompt
+
 BROWSER_SYSTEM_PROMPT = """You are Naeyla with browser control abilities.
 
 You can control a web browser using special action tags. When the user asks you to visit websites or perform web actions, use these tags:
@@ -30,7 +32,5 @@ Always include the action tag when asked to navigate or interact with websites.
 
 def get_browser_prompt(mode: str = "companion") -> str:
     """Get system prompt with browser capabilities"""
-    from model.tokens import get_mode_prompt
-    
     base_prompt = get_mode_prompt(mode)
     return f"{base_prompt}\n\n{BROWSER_SYSTEM_PROMPT}"
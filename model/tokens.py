@@ -44,14 +44,16 @@ CORRECTION_TEMPLATES = {
     }
 }
 
+# Mode -> personality token
+_MODE_TOKEN_MAP = {
+    "companion": "<|companion|>",
+    "advisor": "<|advisor|>",
+    "guardian": "<|guardian|>"
+}
+
 def get_mode_token(mode: str) -> str:
     """Get the special token for a given mode"""
-    mode_map = {
-        "companion": "<|companion|>",
-        "advisor": "<|advisor|>",
-        "guardian": "<|guardian|>"
-    }
-    return mode_map.get(mode, "<|companion|>")
+    return _MODE_TOKEN_MAP.get(mode, "<|companion|>")
 
 def get_mode_prompt(mode: str) -> str:
     """Get the system prompt for a given mode"""